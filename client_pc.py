@@ -3,27 +3,45 @@ import asyncio
 import json
 import logging
 import sys
+import time
 from datetime import datetime
+from functools import partial
 from typing import Optional
 
 import websockets
+from websockets.asyncio.client import ClientConnection
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# JSON编解码：优先使用orjson，输出bytes直接作为二进制帧发送，服务端两种帧都能解析
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _dumps = partial(json.dumps, default=datetime.isoformat)
+    _loads = json.loads
+
 
 class PCClient:
     def __init__(self, server_url: str, user_id: str, token: str = "demo-token"):
         self.server_url = server_url
         self.user_id = user_id
         self.token = token
-        self.websocket: Optional[websockets.WebSocketClientProtocol] = None
+        self.websocket: Optional[ClientConnection] = None
         self.running = False
         
     async def connect(self):
         """连接到WebSocket服务器"""
         try:
-            self.websocket = await websockets.connect(self.server_url)
+            # 心跳由websockets在协议层发送ping控制帧完成
+            self.websocket = await websockets.connect(
+                self.server_url,
+                compression=None,
+                ping_interval=30,
+                ping_timeout=10
+            )
             
             # 发送认证信息
             auth_message = {
@@ -32,14 +50,14 @@ class PCClient:
                     "user_id": self.user_id,
                     "token": self.token
                 },
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
             
-            await self.websocket.send(json.dumps(auth_message))
+            await self.websocket.send(_dumps(auth_message))
             
             # 等待认证响应
             response = await self.websocket.recv()
-            response_data = json.loads(response)
+            response_data = _loads(response)
             
             if response_data.get("type") == "connection_established":
                 logger.info(f"PC客户端 {self.user_id} 连接成功")
@@ -64,12 +82,12 @@ class PCClient:
                 "target_user": target_user,
                 "content": content
             },
-            "timestamp": datetime.now().isoformat(),
-            "message_id": f"msg_{datetime.now().timestamp()}"
+            "timestamp": datetime.now(),
+            "message_id": f"msg_{time.time_ns()}"
         }
         
         try:
-            await self.websocket.send(json.dumps(message))
+            await self.websocket.send(_dumps(message))
             logger.info(f"消息已发送给 {target_user}: {content}")
             return True
         except Exception as e:
@@ -80,7 +98,7 @@ class PCClient:
         """监听来自服务器的消息"""
         try:
             async for message in self.websocket:
-                data = json.loads(message)
+                data = _loads(message)
                 msg_type = data.get("type")
                 
                 if msg_type == "new_message":
@@ -108,23 +126,12 @@ class PCClient:
                     
                 elif msg_type == "ping":
                     # 响应心跳
-                    await self.websocket.send(json.dumps({"type": "pong"}))
+                    await self.websocket.send(_dumps({"type": "pong"}))
                     
         except websockets.exceptions.ConnectionClosed:
             logger.error("连接已关闭")
             self.running = False
     
-    async def heartbeat(self):
-        """发送心跳保持连接"""
-        while self.running:
-            try:
-                if self.websocket:
-                    await self.websocket.send(json.dumps({"type": "ping"}))
-                await asyncio.sleep(30)  # 每30秒发送一次心跳
-            except Exception as e:
-                logger.error(f"心跳发送失败: {e}")
-                break
-    
     async def run(self):
         """运行PC客户端"""
         if not await self.connect():
@@ -132,9 +139,6 @@ class PCClient:
             
         self.running = True
         
-        # 启动心跳任务
-        heartbeat_task = asyncio.create_task(self.heartbeat())
-        
         # 启动消息监听
         listen_task = asyncio.create_task(self.listen_for_messages())
         
@@ -149,7 +153,7 @@ class PCClient:
                 await self.send_message(target_user, test_message)
             
             # 保持运行
-            await asyncio.gather(heartbeat_task, listen_task)
+            await listen_task
             
         except KeyboardInterrupt:
             logger.info("客户端关闭")
@@ -187,9 +191,9 @@ async def interactive_client(user_id: str, server_url: str = "ws://localhost:876
                 # 获取在线用户
                 message = {
                     "type": "get_online_users",
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": datetime.now()
                 }
-                await client.websocket.send(json.dumps(message))
+                await client.websocket.send(_dumps(message))
                 
             elif cmd.startswith("send "):
                 parts = cmd.split(" ", 2)
@@ -13,6 +13,8 @@ class Config:
     CONNECTION_TIMEOUT = 300
     # 最大连接数
     MAX_CONNECTIONS = 1000
+    # 广播时每批并发发送的连接数
+    BROADCAST_BATCH_SIZE = 256
     # Redis配置（可选，用于集群）
     REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
     REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
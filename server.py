@@ -1,16 +1,25 @@
 # server.py
 import asyncio
+import itertools
 import json
 import logging
-import uuid
-from datetime import datetime
-from typing import Dict, Set
+import secrets
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Set, Tuple
 from collections import defaultdict
 
-import websockets
+from websockets.asyncio.server import ServerConnection, serve
 from websockets.exceptions import ConnectionClosed
 
 from config import config
+from server_hotpath import dispatch_message
+
+try:
+    import uvloop
+except ImportError:  # 可选依赖，未安装时使用asyncio默认事件循环
+    uvloop = None
 
 # 配置日志
 logging.basicConfig(
@@ -19,47 +28,114 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# JSON编解码：优先使用orjson（C实现，直接输出UTF-8 bytes，作为二进制帧发送），未安装时回退到标准库
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+# 消息/连接ID：进程级随机前缀 + 自增计数，单进程内唯一
+_ID_PREFIX = secrets.token_hex(4)
+_id_counter = itertools.count().__next__
+
+# 时间戳缓存：[10ms时间片编号, ISO字符串]，同一时间片内的消息复用同一字符串
+_ts_cache = [0, ""]
+
+
+def _timestamp() -> str:
+    """返回当前UTC时间的ISO格式字符串，精度10ms"""
+    t = time.time()
+    tick = int(t * 100)
+    if tick != _ts_cache[0]:
+        _ts_cache[0] = tick
+        _ts_cache[1] = datetime.fromtimestamp(t, timezone.utc).isoformat()
+    return _ts_cache[1]
+
+
+# 固定内容的响应帧，模块加载时序列化一次
+_AUTH_FAIL_FRAME = _dumps({"type": "error", "data": {"message": "认证失败"}})
+
 
 class WebSocketManager:
     def __init__(self):
-        # 用户ID -> WebSocket连接映射
-        self.user_connections: Dict[str, websockets.WebSocketServerProtocol] = {}
-        # 连接ID -> 用户ID映射
-        self.connection_users: Dict[str, str] = {}
+        # 在线用户与连接按下标一一对应（并行列表），广播时顺序遍历
+        self._user_ids: List[str] = []
+        self._sockets: List[ServerConnection] = []
+        # 用户ID -> 列表下标
+        self._index: Dict[str, int] = {}
         # 用户频道订阅
         self.user_channels: Dict[str, Set[str]] = defaultdict(set)
-        # 活跃用户列表
-        self.active_users: Dict[str, datetime] = {}
-
-    async def register(self, websocket: websockets.WebSocketServerProtocol, user_id: str):
-        """注册用户连接"""
-        connection_id = str(uuid.uuid4())
-        self.connection_users[connection_id] = user_id
-        self.user_connections[user_id] = websocket
-        self.active_users[user_id] = datetime.now()
+        # 频道 -> 订阅用户（反向索引，频道广播只遍历订阅者）
+        self.channel_subscribers: Dict[str, Set[str]] = defaultdict(set)
+        # 活跃用户列表（用户ID -> 最后活跃的monotonic时间，秒）
+        self.active_users: Dict[str, float] = {}
+
+    async def register(self, websocket: ServerConnection, user_id: str):
+        """注册用户连接，返回本次连接的ID（仅用于展示和日志）"""
+        connection_id = f"{_ID_PREFIX}-{_id_counter():x}"
+        idx = self._index.get(user_id)
+        if idx is None:
+            self._index[user_id] = len(self._sockets)
+            self._user_ids.append(user_id)
+            self._sockets.append(websocket)
+        else:
+            # 同一用户重新连接，替换旧连接
+            self._sockets[idx] = websocket
+        self.active_users[user_id] = time.monotonic()
         
         logger.info(f"用户 {user_id} 已连接, 连接ID: {connection_id}")
         return connection_id
 
-    async def unregister(self, user_id: str, connection_id: str = None):
+    async def unregister(self, user_id: str):
         """注销用户连接"""
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
-        
-        if connection_id and connection_id in self.connection_users:
-            del self.connection_users[connection_id]
+        idx = self._index.pop(user_id, None)
+        if idx is not None:
+            # 用末尾元素填补空位，O(1)删除
+            last_user = self._user_ids.pop()
+            last_socket = self._sockets.pop()
+            if last_user != user_id:
+                self._user_ids[idx] = last_user
+                self._sockets[idx] = last_socket
+                self._index[last_user] = idx
         
         if user_id in self.active_users:
             del self.active_users[user_id]
         
+        for channel in self.user_channels.pop(user_id, ()):
+            self._remove_subscriber(channel, user_id)
+        
         logger.info(f"用户 {user_id} 已断开连接")
 
+    def subscribe(self, user_id: str, channel: str):
+        """订阅频道"""
+        self.user_channels[user_id].add(channel)
+        self.channel_subscribers[channel].add(user_id)
+
+    def unsubscribe(self, user_id: str, channel: str):
+        """取消订阅频道"""
+        channels = self.user_channels.get(user_id)
+        if channels and channel in channels:
+            channels.remove(channel)
+            self._remove_subscriber(channel, user_id)
+
+    def _remove_subscriber(self, channel: str, user_id: str):
+        """从频道反向索引中移除用户，频道无订阅者时删除该频道"""
+        subscribers = self.channel_subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(user_id)
+            if not subscribers:
+                del self.channel_subscribers[channel]
+
     async def send_to_user(self, user_id: str, message: dict):
         """发送消息给指定用户"""
-        if user_id in self.user_connections:
+        idx = self._index.get(user_id)
+        if idx is not None:
             try:
-                websocket = self.user_connections[user_id]
-                await websocket.send(json.dumps(message))
+                websocket = self._sockets[idx]
+                await websocket.send(_dumps(message))
                 return True
             except ConnectionClosed:
                 logger.warning(f"向用户 {user_id} 发送消息失败，连接已关闭")
@@ -69,23 +145,62 @@ class WebSocketManager:
 
     async def broadcast(self, message: dict, exclude_user: str = None):
         """广播消息给所有用户"""
-        tasks = []
-        for user_id, websocket in self.user_connections.items():
-            if user_id != exclude_user:
-                try:
-                    tasks.append(websocket.send(json.dumps(message)))
-                except ConnectionClosed:
-                    continue
-        if tasks:
-            await asyncio.gather(*tasks)
+        # 只序列化一次，所有接收者共用同一份payload
+        payload = _dumps(message)
+        exclude_idx = self._index.get(exclude_user, -1)
+        user_ids = self._user_ids
+        targets = [
+            (user_ids[i], websocket)
+            for i, websocket in enumerate(self._sockets)
+            if i != exclude_idx
+        ]
+        await self._fan_out(targets, payload)
+
+    async def broadcast_to_channel(self, channel: str, message: dict, exclude_user: str = None):
+        """广播消息给频道的所有订阅者"""
+        subscribers = self.channel_subscribers.get(channel)
+        if not subscribers:
+            return
+        payload = _dumps(message)
+        targets = []
+        for user_id in subscribers:
+            idx = self._index.get(user_id)
+            if idx is not None and user_id != exclude_user:
+                targets.append((user_id, self._sockets[idx]))
+        await self._fan_out(targets, payload)
+
+    async def _fan_out(self, targets: List[Tuple[str, ServerConnection]], payload):
+        """将同一份payload发送给多个连接"""
+        # 分批发送，限制同时挂起的写缓冲数量
+        for start in range(0, len(targets), config.BROADCAST_BATCH_SIZE):
+            async with asyncio.TaskGroup() as tg:
+                for user_id, websocket in targets[start:start + config.BROADCAST_BATCH_SIZE]:
+                    tg.create_task(self._safe_send(websocket, user_id, payload))
+
+    async def _safe_send(self, websocket: ServerConnection, user_id: str, payload):
+        """广播中的单次发送，异常在此处理，不影响同组其他发送"""
+        try:
+            await websocket.send(payload)
+        except ConnectionClosed:
+            logger.warning(f"向用户 {user_id} 广播失败，连接已关闭")
+            # 用户可能已用新连接重新登录，只清理发送失败的那个连接
+            if self.get_connection(user_id) is websocket:
+                await self.unregister(user_id)
+        except Exception as e:
+            logger.error(f"向用户 {user_id} 广播出错: {e}")
+
+    def get_connection(self, user_id: str):
+        """获取用户当前的连接"""
+        idx = self._index.get(user_id)
+        return self._sockets[idx] if idx is not None else None
 
     def get_online_users(self):
-        """获取在线用户列表"""
-        return list(self.active_users.keys())
+        """获取在线用户列表（返回内部列表，调用方只读）"""
+        return self._user_ids
 
     def update_user_activity(self, user_id: str):
         """更新用户活跃时间"""
-        self.active_users[user_id] = datetime.now()
+        self.active_users[user_id] = time.monotonic()
 
 
 class MessageHandler:
@@ -95,18 +210,30 @@ class MessageHandler:
         message = {
             "type": msg_type,
             "data": data,
-            "timestamp": datetime.now().isoformat(),
-            "message_id": str(uuid.uuid4())
+            "timestamp": _timestamp(),
+            "message_id": f"{_ID_PREFIX}-{_id_counter():x}"
         }
         if sender:
             message["sender"] = sender
         return message
 
     @staticmethod
-    def validate_message(message: dict) -> bool:
-        """验证消息格式"""
-        required_fields = ["type", "data", "timestamp"]
-        return all(field in message for field in required_fields)
+    def create_message_bytes(msg_type: str, data: dict, sender: str = None):
+        """创建标准消息并直接序列化，用于只需发送一次的消息"""
+        if sender:
+            return _dumps({
+                "type": msg_type,
+                "data": data,
+                "timestamp": _timestamp(),
+                "message_id": f"{_ID_PREFIX}-{_id_counter():x}",
+                "sender": sender
+            })
+        return _dumps({
+            "type": msg_type,
+            "data": data,
+            "timestamp": _timestamp(),
+            "message_id": f"{_ID_PREFIX}-{_id_counter():x}"
+        })
 
 
 # 全局管理器实例
@@ -130,34 +257,95 @@ async def authenticate(message: dict) -> str:
     return None
 
 
-async def handle_message(websocket: websockets.WebSocketServerProtocol, path: str):
+async def _handle_send_message(websocket: ServerConnection, data: dict, msg_data: dict, user_id: str):
+    """发送消息给其他用户"""
+    target_user = msg_data.get("target_user")
+    content = msg_data.get("content")
+    
+    if target_user and content:
+        # 创建消息
+        msg = message_handler.create_message(
+            "new_message",
+            {
+                "content": content,
+                "from_user": user_id,
+                "to_user": target_user
+            },
+            sender=user_id
+        )
+        
+        # 发送给目标用户
+        success = await ws_manager.send_to_user(target_user, msg)
+        
+        # 回执给发送者
+        receipt = message_handler.create_message_bytes(
+            "message_receipt",
+            {
+                "message_id": data.get("message_id"),
+                "status": "delivered" if success else "failed",
+                "target_user": target_user
+            }
+        )
+        await websocket.send(receipt)
+
+
+async def _handle_subscribe(websocket: ServerConnection, data: dict, msg_data: dict, user_id: str):
+    """订阅频道"""
+    channel = msg_data.get("channel")
+    if channel:
+        ws_manager.subscribe(user_id, channel)
+
+
+async def _handle_unsubscribe(websocket: ServerConnection, data: dict, msg_data: dict, user_id: str):
+    """取消订阅"""
+    channel = msg_data.get("channel")
+    if channel:
+        ws_manager.unsubscribe(user_id, channel)
+
+
+async def _handle_get_online_users(websocket: ServerConnection, data: dict, msg_data: dict, user_id: str):
+    """获取在线用户列表"""
+    online_users = ws_manager.get_online_users()
+    response = message_handler.create_message_bytes(
+        "online_users",
+        {"users": online_users}
+    )
+    await websocket.send(response)
+
+
+# 消息类型 -> 处理函数，调用参数为 (连接, 完整消息, 消息的data字段, 用户ID)
+_DISPATCH = {
+    "send_message": _handle_send_message,
+    "subscribe": _handle_subscribe,
+    "unsubscribe": _handle_unsubscribe,
+    "get_online_users": _handle_get_online_users,
+}
+
+
+async def handle_message(websocket: ServerConnection):
     """处理WebSocket连接"""
     user_id = None
-    connection_id = None
     
     try:
         # 等待认证消息
         auth_message = await asyncio.wait_for(websocket.recv(), timeout=10)
-        auth_data = json.loads(auth_message)
+        auth_data = _loads(auth_message)
         
         # 认证用户
         user_id = await authenticate(auth_data)
         if not user_id:
-            await websocket.send(json.dumps({
-                "type": "error",
-                "data": {"message": "认证失败"}
-            }))
+            await websocket.send(_AUTH_FAIL_FRAME)
             return
         
         # 注册连接
         connection_id = await ws_manager.register(websocket, user_id)
         
         # 发送连接成功消息
-        welcome_msg = message_handler.create_message(
+        welcome_msg = message_handler.create_message_bytes(
             "connection_established",
             {"user_id": user_id, "connection_id": connection_id}
         )
-        await websocket.send(json.dumps(welcome_msg))
+        await websocket.send(welcome_msg)
         
         # 通知其他用户（可选）
         await ws_manager.broadcast(
@@ -174,74 +362,8 @@ async def handle_message(websocket: websockets.WebSocketServerProtocol, path: st
         # 主消息循环
         async for message in websocket:
             try:
-                data = json.loads(message)
-                
-                if not message_handler.validate_message(data):
-                    continue
-                
-                # 更新用户活跃时间
-                ws_manager.update_user_activity(user_id)
-                
-                msg_type = data["type"]
-                
-                if msg_type == "ping":
-                    # 心跳响应
-                    await websocket.send(json.dumps({
-                        "type": "pong",
-                        "timestamp": datetime.now().isoformat()
-                    }))
-                
-                elif msg_type == "send_message":
-                    # 发送消息给其他用户
-                    target_user = data["data"].get("target_user")
-                    content = data["data"].get("content")
-                    
-                    if target_user and content:
-                        # 创建消息
-                        msg = message_handler.create_message(
-                            "new_message",
-                            {
-                                "content": content,
-                                "from_user": user_id,
-                                "to_user": target_user
-                            },
-                            sender=user_id
-                        )
-                        
-                        # 发送给目标用户
-                        success = await ws_manager.send_to_user(target_user, msg)
-                        
-                        # 回执给发送者
-                        receipt = message_handler.create_message(
-                            "message_receipt",
-                            {
-                                "message_id": data.get("message_id"),
-                                "status": "delivered" if success else "failed",
-                                "target_user": target_user
-                            }
-                        )
-                        await websocket.send(json.dumps(receipt))
-                
-                elif msg_type == "subscribe":
-                    # 订阅频道
-                    channel = data["data"].get("channel")
-                    if channel:
-                        ws_manager.user_channels[user_id].add(channel)
-                
-                elif msg_type == "unsubscribe":
-                    # 取消订阅
-                    channel = data["data"].get("channel")
-                    if channel and channel in ws_manager.user_channels[user_id]:
-                        ws_manager.user_channels[user_id].remove(channel)
-                
-                elif msg_type == "get_online_users":
-                    # 获取在线用户列表
-                    online_users = ws_manager.get_online_users()
-                    response = message_handler.create_message(
-                        "online_users",
-                        {"users": online_users}
-                    )
-                    await websocket.send(json.dumps(response))
+                data = _loads(message)
+                await dispatch_message(websocket, data, user_id, ws_manager, _DISPATCH)
                 
             except json.JSONDecodeError:
                 logger.error(f"消息JSON解析失败: {message}")
@@ -256,7 +378,7 @@ async def handle_message(websocket: websockets.WebSocketServerProtocol, path: st
         logger.error(f"连接处理错误: {e}")
     finally:
         if user_id:
-            await ws_manager.unregister(user_id, connection_id)
+            await ws_manager.unregister(user_id)
             # 通知其他用户离线
             await ws_manager.broadcast(
                 message_handler.create_message(
@@ -272,12 +394,11 @@ async def health_check():
     """健康检查，清理不活跃连接"""
     while True:
         await asyncio.sleep(60)  # 每分钟检查一次
-        now = datetime.now()
-        inactive_users = []
-        
-        for user_id, last_active in ws_manager.active_users.items():
-            if (now - last_active).seconds > config.CONNECTION_TIMEOUT:
-                inactive_users.append(user_id)
+        cutoff = time.monotonic() - config.CONNECTION_TIMEOUT
+        inactive_users = [
+            user_id for user_id, last_active in ws_manager.active_users.items()
+            if last_active < cutoff
+        ]
         
         for user_id in inactive_users:
             logger.info(f"清理不活跃用户: {user_id}")
@@ -286,17 +407,24 @@ async def health_check():
 
 async def main():
     """启动WebSocket服务器"""
+    # websockets的C扩展负责客户端帧的掩码运算，缺失时退化为纯Python实现
+    try:
+        import websockets.speedups  # noqa: F401
+    except ImportError:
+        logger.warning("未找到websockets.speedups，建议安装带C扩展的websockets以加速帧掩码处理")
+    
     # 启动健康检查任务
     asyncio.create_task(health_check())
     
     # 启动WebSocket服务器
-    server = await websockets.serve(
+    server = await serve(
         handle_message,
         config.HOST,
         config.PORT,
         ping_interval=config.HEARTBEAT_INTERVAL,
         ping_timeout=10,
-        max_size=2**20  # 1MB最大消息大小
+        max_size=2**20,  # 1MB最大消息大小
+        compression=None  # 消息均为小JSON帧，关闭permessage-deflate节省CPU
     )
     
     logger.info(f"WebSocket服务器启动在 ws://{config.HOST}:{config.PORT}")
@@ -308,4 +436,8 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # 非Windows平台优先使用uvloop（libuv实现的事件循环）
+    if uvloop is not None and sys.platform != "win32":
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
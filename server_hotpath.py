@@ -0,0 +1,32 @@
+# server_hotpath.py
+"""
+消息主循环中每条消息的处理逻辑
+
+带完整类型注解，可用mypyc编译为C扩展以减少解释器开销：
+    pip install mypy && mypyc server_hotpath.py
+编译产物（server_hotpath.*.so / .pyd）会优先于本文件被导入；
+未编译时作为普通Python模块使用（PyPy下由JIT优化）。
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+# 处理函数签名: (连接, 完整消息, 消息的data字段, 用户ID)
+Handler = Callable[[Any, Any, Any, str], Awaitable[None]]
+
+
+async def dispatch_message(
+    websocket: Any,
+    data: Any,
+    user_id: str,
+    manager: Any,
+    handlers: Dict[str, Handler],
+) -> None:
+    """验证消息格式，更新用户活跃时间，并分发给对应类型的处理函数"""
+    if not ("type" in data and "data" in data and "timestamp" in data):
+        return
+
+    # 更新用户活跃时间
+    manager.update_user_activity(user_id)
+
+    handler = handlers.get(data["type"])
+    if handler is not None:
+        await handler(websocket, data, data["data"] or {}, user_id)
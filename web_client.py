@@ -2,12 +2,23 @@
 import asyncio
 import os
 from pathlib import Path
+from typing import Optional
 from aiohttp import web
 import aiohttp_jinja2
 import jinja2
 
+try:
+    import uvloop
+except ImportError:  # 可选依赖，未安装时使用asyncio默认事件循环
+    uvloop = None
+
 routes = web.RouteTableDef()
 
+# WebSocket服务器端口
+WS_PORT = 8765
+# 启动时生成的固定WebSocket地址（未设置WS_HOST时为None）
+WS_URL_KEY = web.AppKey('ws_url', Optional[str])
+
 
 @routes.get('/')
 @aiohttp_jinja2.template('index.html')
@@ -21,14 +32,12 @@ async def index(request):
 async def ws_test(request):
     """WebSocket测试页面"""
     user_id = request.match_info['user_id']
-    # 获取主机地址，支持外部访问
-    host = request.host
-    ws_host = request.headers.get('Host', 'localhost:8765').split(':')[0]
-    ws_port = 8765
+    # 未配置WS_HOST时使用页面访问的主机名，支持外部访问
+    ws_url = request.app[WS_URL_KEY] or f'ws://{request.url.host}:{WS_PORT}'
     
     return {
         'user_id': user_id,
-        'ws_url': f'ws://{ws_host}:{ws_port}'
+        'ws_url': ws_url
     }
 
 
@@ -42,14 +51,19 @@ async def init_app():
     """初始化应用"""
     app = web.Application()
     
-    # 设置Jinja2模板
     current_dir = Path(__file__).parent
     templates_dir = current_dir / 'templates'
+    static_dir = current_dir / 'static'
     
-    # 确保模板目录存在
-    if not templates_dir.exists():
-        os.makedirs(templates_dir, exist_ok=True)
+    # 确保模板目录和静态目录存在
+    for directory in (templates_dir, static_dir):
+        directory.mkdir(parents=True, exist_ok=True)
     
+    # WebSocket地址：设置WS_HOST时在启动时生成固定地址，否则按请求生成
+    ws_host = os.environ.get('WS_HOST')
+    app[WS_URL_KEY] = f'ws://{ws_host}:{WS_PORT}' if ws_host else None
+    
+    # 设置Jinja2模板
     aiohttp_jinja2.setup(
         app,
         loader=jinja2.FileSystemLoader(str(templates_dir))
@@ -58,11 +72,6 @@ async def init_app():
     # 添加路由
     app.add_routes(routes)
     
-    # 创建静态目录（如果不存在）
-    static_dir = current_dir / 'static'
-    if not static_dir.exists():
-        os.makedirs(static_dir, exist_ok=True)
-    
     # 添加静态文件服务
     app.router.add_static('/static/', path=str(static_dir), name='static')
     
@@ -110,6 +119,10 @@ if __name__ == "__main__":
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
     
     try:
-        asyncio.run(main())
+        # 非Windows平台优先使用uvloop
+        if uvloop is not None and os.name != 'nt':
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\n服务器已停止")
\ No newline at end of file